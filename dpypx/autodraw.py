@@ -2,18 +2,30 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
 import logging
-from typing import Iterator, Optional
+from typing import Optional
 
+import numpy as np
 from PIL import Image
 
-from .canvas import Canvas, Pixel
+from .canvas import Canvas
 from .client import Client
 from .errors import EndpointDisabledError
 
 
 logger = logging.getLogger('dpypx')
 
+# Resampling filters that can be used when scaling images.
+RESAMPLING_FILTERS = {
+    'nearest': Image.NEAREST,
+    'box': Image.BOX,
+    'bilinear': Image.BILINEAR,
+    'hamming': Image.HAMMING,
+    'bicubic': Image.BICUBIC,
+    'lanczos': Image.LANCZOS,
+}
+
 
 class AutoDrawer:
     """Tool for automatically drawing images."""
@@ -21,23 +33,37 @@ class AutoDrawer:
     @classmethod
     def load_image(
             cls, client: Client, xy: tuple[int, int],
-            image: Image.Image, scale: float = 1) -> AutoDrawer:
-        """Draw from the pixels of an image."""
-        image = image.convert(mode="RGBA")
+            image: Image.Image, scale: float = 1,
+            resample: str = 'lanczos') -> AutoDrawer:
+        """Draw from the pixels of an image.
+
+        `resample` is the name of the filter to use when scaling the image,
+        one of the keys of `RESAMPLING_FILTERS`. If `image` has not been
+        loaded yet, it may be loaded at a reduced size (this changes `image`
+        itself).
+        """
+        if resample not in RESAMPLING_FILTERS:
+            raise ValueError(f'Invalid resampling filter "{resample}".')
         width = round(image.width * scale)
         height = round(image.height * scale)
+        if not (width and height):
+            raise ValueError(f'Scale {scale} is too small for this image.')
+        # If the image hasn't been loaded yet, this lets the decoder do some
+        # of the downscaling (only JPEG supports this). We ask for double the
+        # size so the resize below still has detail to work with.
+        image.draft('RGB', (width * 2, height * 2))
+        # Only keep an alpha channel if there is one to begin with.
+        has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert(mode='RGBA' if has_alpha else 'RGB')
         # Since the image is only loaded once we can afford to use a high
-        # quality filter.
-        resized = image.resize((width, height), Image.LANCZOS)
-        data = list(resized.getdata())
-        grid = [
-            [
-                (Pixel(*pixel[:3]), pixel[3] > 127)
-                for pixel in data[start:start + width]
-            ]
-            for start in range(0, len(data), width)
-        ]
-        return cls(client, *xy, grid)
+        # quality filter, and reducing_gap makes it much cheaper anyway.
+        resized = image.resize(
+            (width, height), RESAMPLING_FILTERS[resample], reducing_gap=2.0
+        )
+        data = np.asarray(resized)
+        if not has_alpha:
+            return cls(client, *xy, data, np.ones((height, width), dtype=bool))
+        return cls(client, *xy, data[..., :3], data[..., 3] > 127)
 
     @classmethod
     def load(cls, client: Client, data: str) -> AutoDrawer:
@@ -49,88 +75,197 @@ class AutoDrawer:
         pixels of the image, as hex codes (horizontal scanlines, left-to-right
         top-to-bottom).
         """
-        lines = data.split('\n')
-        x = int(lines.pop(0))
-        y = int(lines.pop(0))
-        width = int(lines.pop(0))
-        height = int(lines.pop(0))
-        grid = []
-        for _ in range(height):
-            row = []
-            for _ in range(width):
-                row.append((Pixel.from_hex(lines.pop(0)), True))
-            grid.append(row)
-        return cls(client, x, y, grid)
+        lines = iter(data.splitlines())
+        x = int(next(lines))
+        y = int(next(lines))
+        width = int(next(lines))
+        height = int(next(lines))
+        pixels = [
+            line.lstrip('#')
+            for line in itertools.islice(lines, width * height)
+        ]
+        if len(pixels) != width * height:
+            raise ValueError(
+                f'Expected {width * height} pixels, got {len(pixels)}.'
+            )
+        for index, pixel in enumerate(pixels):
+            if len(pixel) != 6:
+                raise ValueError(
+                    f'Invalid hex code "{pixel}" for pixel {index}.'
+                )
+        # Parse all the pixels in one go, rather than one at a time.
+        try:
+            raw = bytes.fromhex(''.join(pixels))
+        except ValueError:
+            # Find the line at fault, for a more helpful error.
+            for index, pixel in enumerate(pixels):
+                try:
+                    bytes.fromhex(pixel)
+                except ValueError:
+                    raise ValueError(
+                        f'Invalid hex code "{pixel}" for pixel {index}.'
+                    ) from None
+            raise
+        rgb = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 3)
+        return cls(client, x, y, rgb, np.ones((height, width), dtype=bool))
 
     def __init__(
-            self, client: Client, x: int, y: int, grid: list[list[Pixel]]):
-        """Store the plan."""
+            self, client: Client, x: int, y: int,
+            rgb: np.ndarray, opaque: np.ndarray):
+        """Store the plan.
+
+        `rgb` is a (height, width, 3) array of the colours to draw, and
+        `opaque` is a (height, width) boolean array of which pixels to draw.
+        """
         self.client = client
-        self.grid = grid
+        self.rgb = rgb
+        self.opaque = opaque
+        # Plans loaded from hex codes (or opaque images) have no transparent
+        # pixels, so there's no need to look at the mask for each pixel.
+        self.all_opaque = bool(opaque.all())
+        # The colours packed as 0xRRGGBB ints, to compare with Canvas.packed.
+        self.target = (
+            rgb[..., 0].astype(np.uint32) << 16
+            | rgb[..., 1].astype(np.uint32) << 8
+            | rgb[..., 2]
+        )
+        # Hex codes of every colour we might draw, formatted once up front.
+        self.palette = {
+            int(colour): f'{colour:06X}'
+            for colour in np.unique(self.target[opaque])
+        }
         self.canvas: Optional[Canvas] = None
+        # Our part of the canvas (packed), kept up to date as we draw.
+        self.current: Optional[np.ndarray] = None
+        # How many pixels to draw before downloading the canvas again.
+        self.refresh_every = 10
+        self._writes_since_refresh = 0
+        height, width = opaque.shape
         # Top left coords.
         self.x0 = x
         self.y0 = y
         # Bottom right coords.
-        self.x1 = x + len(self.grid[0])
-        self.y1 = y + len(self.grid)
+        self.x1 = x + width
+        self.y1 = y + height
 
     async def update_canvas(self):
         """Update our cache of the canvas, if possible."""
+        # Reset before waiting, so other workers don't start a refresh too.
+        self._writes_since_refresh = 0
         try:
             self.canvas = await self.client.get_canvas()
         except EndpointDisabledError:
             logger.warning('Unable to get canvas (endpoint disabled).')
+        else:
+            self.current = self.canvas.packed[
+                self.y0:self.y1, self.x0:self.x1
+            ].copy()
+
+    async def _refresh_if_stale(self):
+        """Update our cache of the canvas if we have drawn enough since."""
+        if self._writes_since_refresh >= self.refresh_every:
+            await self.update_canvas()
 
-    def _iter_coords(
-            self, top_to_bottom: bool = False) -> Iterator[tuple[int, int]]:
-        """Iterate over the coordinates of the image."""
+    def _find_mismatches(self, top_to_bottom: bool = False) -> np.ndarray:
+        """Get the coordinates of the pixels that still need drawing.
+
+        Returns an (n, 2) array of x, y coordinates in drawing order. This is
+        row by row (the order the arrays are stored in), unless
+        `top_to_bottom` is passed, in which case it is column by column.
+        """
+        if self.current is None:
+            todo = self.opaque
+        elif self.all_opaque:
+            todo = self.current != self.target
+        else:
+            todo = self.opaque & (self.current != self.target)
         if top_to_bottom:
-            for x in range(self.x0, self.x1):
-                for y in range(self.y0, self.y1):
-                    yield x, y
+            dxs, dys = np.nonzero(todo.T)
         else:
-            for y in range(self.y0, self.y1):
-                for x in range(self.x0, self.x1):
-                    yield x, y
+            dys, dxs = np.nonzero(todo)
+        return np.column_stack((dxs + self.x0, dys + self.y0))
 
     async def check_pixel(self, x: int, y: int) -> bool:
         """Draw a pixel if not already drawn.
 
         Returns True if the pixel was not already drawn.
         """
-        colour, opaque = self.grid[y - self.y0][x - self.x0]
-	if not opaque:
-            logger.debug(f"Skipping transparent pixel at {x}, {y}.")
+        # Index all the arrays with one tuple rather than rebuilding it.
+        index = y - self.y0, x - self.x0
+        if not (self.all_opaque or self.opaque[index]):
+            logger.debug(f'Skipping transparent pixel at {x}, {y}.')
             return False
-        if self.canvas and self.canvas[x, y] == colour:
+        target = self.target[index]
+        current = self.current
+        if current is not None and current[index] == target:
             logger.debug(f'Skipping already correct pixel at {x}, {y}.')
             return False
-        await self.client.put_pixel(x, y, colour)
+        await self.client.put_pixel(x, y, self.palette[target])
+        # Assume our pixel is still there until we next get the canvas. This
+        # must look up self.current again, since another worker may have
+        # refreshed it while we were waiting.
+        if self.current is not None:
+            self.current[index] = target
+        self._writes_since_refresh += 1
         return True
 
-    async def draw(self, top_to_bottom: bool = False):
-        """Draw the pixels of the image, attempting each pixel max. once."""
-        await self.update_canvas()
-        for x, y in self._iter_coords(top_to_bottom):
+    async def _draw_worker(self, queue: asyncio.Queue):
+        """Draw pixels from a queue of coordinates until it is empty."""
+        while not queue.empty():
+            x, y = queue.get_nowait()
             if await self.check_pixel(x, y):
-                await self.update_canvas()
+                await self._refresh_if_stale()
+
+    async def draw(self, top_to_bottom: bool = False, workers: int = 4):
+        """Draw the pixels of the image, attempting each pixel max. once.
+
+        Up to `workers` pixels are drawn concurrently. The client's
+        ratelimiting still applies to each of them.
+        """
+        if workers < 1:
+            raise ValueError('workers must be at least 1.')
+        await self.update_canvas()
+        queue = asyncio.Queue()
+        for x, y in self._find_mismatches(top_to_bottom):
+            queue.put_nowait((int(x), int(y)))
+        tasks = [
+            asyncio.create_task(self._draw_worker(queue))
+            for _ in range(workers)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Only has an effect if one of the workers failed.
+            for task in tasks:
+                task.cancel()
 
     async def draw_and_fix(
             self,
             forever: bool = True,
-            top_to_bottom: bool = False):
-        """Draw the pixels of the image, prioritise fixing existing ones."""
-        work_to_do = True
-        while work_to_do:
-            await self.update_canvas()
-            work_to_do = False
-            for x, y in self._iter_coords(top_to_bottom):
-                if await self.check_pixel(x, y):
-                    work_to_do = True
-                    await self.update_canvas()
-                    break
-            if forever and not work_to_do:
-                logger.info('Entire image is correct, waiting 1s to loop.')
-                await asyncio.sleep(1)
-                work_to_do = True
+            top_to_bottom: bool = False,
+            interval: float = 1):
+        """Draw the pixels of the image, prioritise fixing existing ones.
+
+        If `forever` is set, once the image is correct the canvas is checked
+        again every `interval` seconds (or less often, if the canvas
+        endpoint's ratelimit requires it).
+        """
+        await self.update_canvas()
+        while True:
+            mismatches = self._find_mismatches(top_to_bottom)
+            if len(mismatches):
+                x, y = mismatches[0]
+                await self.check_pixel(int(x), int(y))
+                await self._refresh_if_stale()
+            elif self._writes_since_refresh:
+                # Check the pixels we drew since the last update are still
+                # there before deciding we're done.
+                await self.update_canvas()
+            elif forever:
+                logger.info(
+                    f'Entire image is correct, waiting {interval}s to loop.'
+                )
+                await asyncio.sleep(interval)
+                await self.update_canvas()
+            else:
+                break
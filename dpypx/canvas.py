@@ -1,27 +1,34 @@
 """Container for all the pixels on a canvas."""
 from __future__ import annotations
 
+import functools
+from typing import NamedTuple
+
+import numpy as np
 import PIL.Image
 
 from .errors import CanvasFormatError
 
 
-class Pixel:
-    """A single pixel of the canvas."""
+class Pixel(NamedTuple):
+    """A single pixel of the canvas.
+
+    Since this is a tuple, comparing pixels is a plain tuple comparison.
+    """
+
+    red: int
+    green: int
+    blue: int
 
     @classmethod
     def from_hex(cls, hex: str) -> Pixel:
         """Load a pixel colour from a hex string."""
-        hex = hex.lstrip('#')
-        return cls(*(int(hex[i:i + 2], 16) for i in range(0, 6, 2)))
-
-    def __init__(self, red: int, green: int, blue: int):
-        """Store the pixel."""
-        self.red, self.green, self.blue = red, green, blue
+        red, green, blue = bytes.fromhex(hex.lstrip('#'))
+        return cls(red, green, blue)
 
     def __str__(self) -> str:
         """Get the pixel as a hex string."""
-        return f'#{self.red:0>2x}{self.green:0>2x}{self.blue:0>2x}'
+        return f'#{int(self):0>6x}'
 
     def __int__(self) -> int:
         """Get the pixel as a 3-byte int."""
@@ -29,12 +36,8 @@ class Pixel:
 
     @property
     def triple(self) -> tuple[int, int, int]:
-        """Get the pixel as an RGB triple."""
-        return self.red, self.green, self.blue
-
-    def __eq__(self, other: Pixel) -> bool:
-        """Check if this pixel holds the same value as another."""
-        return self.triple == other.triple
+        """Get the pixel as a plain RGB tuple."""
+        return tuple(self)
 
 
 class Canvas:
@@ -50,20 +53,32 @@ class Canvas:
                 f'Expected {expected_length} bytes, got {actual_length} '
                 'bytes.'
             )
-        pixels = []
-        for start_idx in range(0, len(data), 3):
-            pixels.append(Pixel(*data[start_idx:start_idx + 3]))
-        self.grid = [
-            pixels[row * self.width:(row + 1) * self.width]
-            for row in range(self.height)
-        ]
+        # A view onto the raw data, so this doesn't copy anything.
+        self.grid = np.frombuffer(data, dtype=np.uint8).reshape(
+            self.height, self.width, 3
+        )
+        # Each pixel packed into a single 0xRRGGBB int, for fast comparisons.
+        self.packed = (
+            self.grid[..., 0].astype(np.uint32) << 16
+            | self.grid[..., 1].astype(np.uint32) << 8
+            | self.grid[..., 2]
+        )
         self.raw = data
-        self.image = PIL.Image.frombytes('RGB', size, data)
 
-    def __getitem__(self, xy: tuple[int, int]):
+    def __getitem__(self, xy: tuple[int, int]) -> Pixel:
         """Get a pixel by coordinates."""
         x, y = xy
-        return self.grid[y][x]
+        red, green, blue = self.grid[y, x]
+        return Pixel(int(red), int(green), int(blue))
+
+    @functools.cached_property
+    def image(self) -> PIL.Image.Image:
+        """Get the canvas as an image.
+
+        This is only created when first needed, since most users of the
+        canvas only look at individual pixels.
+        """
+        return PIL.Image.frombytes('RGB', (self.width, self.height), self.raw)
 
     def show(self):
         """Display the image."""
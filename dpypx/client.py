@@ -1,12 +1,19 @@
 """HTTP client to the pixel API."""
 from __future__ import annotations
 
+import asyncio
+import json
 import logging
 from datetime import datetime, timedelta
-from typing import Union, Optional
+from typing import Iterable, Union, Optional
 
 import aiohttp
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from .canvas import Canvas, Pixel
 from .colours import Colour, parse_colour
 from .errors import (
@@ -21,6 +28,17 @@ from . import ratelimits
 
 logger = logging.getLogger('dpypx')
 
+# Use orjson if it's installed, since it's much faster.
+if orjson:
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+else:
+    def _json_dumps(data: dict) -> bytes:
+        """Serialise data as JSON."""
+        return json.dumps(data).encode()
+
+    _json_loads = json.loads
+
 
 class Client:
     """HTTP client to the pixel API."""
@@ -30,9 +48,14 @@ class Client:
             token: str,
             base_url: str = 'https://pixels.pythondiscord.com/',
             *,
+            canvas_size: Optional[tuple[int, int]] = None,
             # Param exists for backwards compatibility, no longer needed.
             ratelimit_save_file: Optional[str] = None):
-        """Store the token and set up the client."""
+        """Store the token and set up the client.
+
+        If the size of the canvas is already known, it can be passed as
+        `canvas_size` to save requesting it.
+        """
         self.base_url = base_url
         self.headers = {
             'Authorization': 'Bearer ' + token,
@@ -42,11 +65,29 @@ class Client:
         self.ratelimits = ratelimits.RateLimiter(self)
         # Dict of endpoint to unlock date.
         self.locked: dict[str, datetime] = {}
+        # Cached result of get_canvas_size.
+        self.canvas_size = canvas_size
+        # Created on first use, so it is bound to the right event loop.
+        self._size_lock: Optional[asyncio.Lock] = None
 
     async def get_client(self) -> aiohttp.ClientSession:
-        """Get or create the client session."""
+        """Get or create the client session.
+
+        The session is kept for the lifetime of the client, so connections
+        to the API are reused rather than being set up for every request.
+        """
         if (not self.client) or self.client.closed:
-            self.client = aiohttp.ClientSession(headers=self.headers)
+            connector = aiohttp.TCPConnector(
+                limit=256,
+                limit_per_host=32,
+                ttl_dns_cache=300,
+                keepalive_timeout=75
+            )
+            self.client = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=30, sock_connect=5)
+            )
         return self.client
 
     async def send_request(
@@ -54,14 +95,26 @@ class Client:
             method: str,
             endpoint: str,
             data: Optional[dict] = None,
-            params: Optional[dict] = None) -> Union[dict, bytes, None]:
-        """Make a basic HTTP request to the API."""
+            params: Optional[dict] = None,
+            buffer: Optional[bytearray] = None
+            ) -> Union[dict, bytes, bytearray, None]:
+        """Make a basic HTTP request to the API.
+
+        If `buffer` is passed, a non-JSON response body is read into it
+        (resizing it if the length doesn't match) and it is returned.
+        """
         logger.debug(
             f'Request: {method} {endpoint} data={data!r} params={params!r}.'
         )
         client = await self.get_client()
+        if data is None:
+            body = headers = None
+        else:
+            body = _json_dumps(data)
+            headers = {'Content-Type': 'application/json'}
         request = client.request(
-            method, self.base_url + endpoint, json=data, params=params
+            method, self.base_url + endpoint,
+            data=body, headers=headers, params=params
         )
         async with request as response:
             if 500 > response.status >= 400:
@@ -74,13 +127,15 @@ class Client:
                     self.locked[endpoint] = datetime.now() + length
                     class_ = EndpointDisabledError
                 elif response.status == 429:
+                    # May include a cooldown we need to wait for.
+                    self.ratelimits.update(endpoint, response.headers)
                     class_ = RatelimitedError
                 else:
                     class_ = HttpClientError
                 if method == 'HEAD':
                     detail = 'No body (HEAD request).'
                 else:
-                    data = await response.json()
+                    data = _json_loads(await response.read())
                     detail = data.get('message', data.get(
                         'detail', 'No error message.'
                     ))
@@ -91,7 +146,15 @@ class Client:
             if method == 'HEAD':
                 return
             elif response.headers['Content-Type'] == 'application/json':
-                return await response.json()
+                return _json_loads(await response.read())
+            elif buffer is not None:
+                offset = 0
+                async for chunk in response.content.iter_chunked(65536):
+                    # This copies in place unless we go past the end.
+                    buffer[offset:offset + len(chunk)] = chunk
+                    offset += len(chunk)
+                del buffer[offset:]
+                return buffer
             else:
                 return await response.read()
 
@@ -102,31 +165,45 @@ class Client:
             *,
             data: Optional[dict] = None,
             params: Optional[dict] = None,
-            ratelimit_after: bool = False) -> Union[dict, bytes, None]:
+            buffer: Optional[bytearray] = None,
+            ratelimit_after: bool = False
+            ) -> Union[dict, bytes, bytearray, None]:
         """Make a call to an endpoint, respecting ratelimiting."""
         if endpoint in self.locked:
             if self.locked[endpoint] < datetime.now():
                 del self.locked[endpoint]
             else:
                 raise EndpointDisabledError(410, 'Endpoint unavailable.')
+        limiter = self.ratelimits[endpoint]
         retry = True
         while retry:
             # Always check before sending a request, even if we *want* to wait
             # after, sending a request and getting ratelimited is undesirable.
-            await self.ratelimits.pause(endpoint)
+            await limiter.pause()
+            limiter.in_flight += 1
             try:
-                resp = await self.send_request(method, endpoint, data, params)
+                resp = await self.send_request(
+                    method, endpoint, data, params, buffer
+                )
             except RatelimitedError:
                 retry = True
             else:
                 retry = False
+            finally:
+                limiter.in_flight -= 1
             if ratelimit_after:
-                await self.ratelimits.pause(endpoint)
+                # The request has already been made, so don't take a token.
+                await limiter.pause(consume=False)
         return resp
 
     async def put_pixel(
             self, x: int, y: int, colour: Union[int, str, Colour]) -> str:
-        """Draw a pixel and return a message."""
+        """Draw a pixel and return a message.
+
+        Raises ValueError without making a request if the coordinates are
+        outside the canvas.
+        """
+        await self.check_coords(x, y)
         # Wait for ratelimits *after* making request, not before. This makes
         # sense because we don't know how the canvas may have changed by the
         # time we have finished waiting, whereas for GET endpoints, we want to
@@ -139,15 +216,87 @@ class Client:
         logger.info('Success: {message}'.format(**data))
         return data['message']
 
+    async def put_pixels(
+            self,
+            pixels: Iterable[tuple[int, int, Union[int, str, Colour]]],
+            concurrency: int = 4) -> list[str]:
+        """Draw several pixels, with up to `concurrency` requests at once.
+
+        `pixels` should be (x, y, colour) tuples. Returns the message for
+        each pixel, in the same order. If one of them fails, the rest are
+        cancelled.
+        """
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1.')
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def put_pixel(x: int, y: int, colour: Union[int, str, Colour]):
+            async with semaphore:
+                return await self.put_pixel(x, y, colour)
+
+        tasks = [
+            asyncio.create_task(put_pixel(x, y, colour))
+            for x, y, colour in pixels
+        ]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # Only has an effect if one of the pixels failed.
+            for task in tasks:
+                task.cancel()
+
+    async def check_coords(self, x: int, y: int):
+        """Raise ValueError if the coordinates are outside the canvas.
+
+        The coordinates aren't checked if the canvas size is unavailable. If
+        they are past the edge of the cached size, the size is requested
+        again in case the canvas has grown.
+        """
+        if x < 0 or y < 0:
+            raise ValueError(
+                f'Coordinates ({x}, {y}) are outside the canvas.'
+            )
+        try:
+            width, height = await self.get_canvas_size()
+            if x >= width or y >= height:
+                self.canvas_size = None
+                width, height = await self.get_canvas_size()
+        except (HttpClientError, ServerError):
+            return
+        if x >= width or y >= height:
+            raise ValueError(
+                f'Coordinates ({x}, {y}) are outside the canvas '
+                f'({width}x{height}).'
+            )
+
     async def get_canvas_size(self) -> tuple[int, int]:
-        """Get the size of the canvas."""
-        data = await self.request('GET', 'get_size')
-        return data['width'], data['height']
+        """Get the size of the canvas.
+
+        This is only requested from the API once, and then cached. Concurrent
+        callers share a single request.
+        """
+        if self.canvas_size:
+            return self.canvas_size
+        if not self._size_lock:
+            self._size_lock = asyncio.Lock()
+        async with self._size_lock:
+            # Another caller may have fetched it while we were waiting.
+            if not self.canvas_size:
+                data = await self.request('GET', 'get_size')
+                self.canvas_size = data['width'], data['height']
+        return self.canvas_size
 
     async def get_canvas(self) -> Canvas:
         """Request the entire canvas."""
-        data = await self.request('GET', 'get_pixels')
         size = await self.get_canvas_size()
+        # Read the canvas straight into a buffer of the right size, rather
+        # than letting aiohttp collect the chunks and join them.
+        data = bytearray(size[0] * size[1] * 3)
+        await self.request('GET', 'get_pixels', buffer=data)
+        if len(data) != size[0] * size[1] * 3:
+            # The canvas may have been resized since we cached the size.
+            self.canvas_size = None
+            size = await self.get_canvas_size()
         return Canvas(size, data)
 
     async def get_pixel(self, x: int, y: int) -> Pixel:
@@ -173,4 +322,14 @@ class Client:
 
     async def close(self):
         """Close the underlying session."""
-        await self.client.close()
+        if self.client:
+            await self.client.close()
+
+    async def __aenter__(self) -> Client:
+        """Open the underlying session when entering a context manager."""
+        await self.get_client()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Close the underlying session when exiting a context manager."""
+        await self.close()
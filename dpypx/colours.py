@@ -1,7 +1,7 @@
 """Utilities for accepting colour input."""
 import enum
-import re
-from typing import Union
+import functools
+from typing import Optional, Union
 
 from .canvas import Pixel
 
@@ -26,23 +26,80 @@ class Colour(enum.Enum):
     DISCORD_BLACK = '23272A'
 
 
+_HEX_DIGITS = frozenset('0123456789ABCDEF')
+_COLOUR_NAMES = Colour.__members__
+
+
+def _parse_int(value: int) -> Optional[str]:
+    """Parse a colour given as a 3-byte int."""
+    if value >= 0 and value <= 0xFFFFFF:
+        return '%06x' % value
+
+
+def _parse_str(value: str) -> Optional[str]:
+    """Parse a colour given as a hex code or the name of a colour."""
+    neat_value = value.lstrip('#').upper()
+    if len(neat_value) == 6 and _HEX_DIGITS.issuperset(neat_value):
+        return neat_value
+    if value.upper() in _COLOUR_NAMES:
+        return _COLOUR_NAMES[value.upper()].value
+
+
+def _parse_colour_member(value: Colour) -> str:
+    """Parse a colour given as a member of the Colour enum."""
+    return value.value
+
+
+def _parse_pixel(value: Pixel) -> str:
+    """Parse a colour given as a pixel."""
+    return '%06x' % int(value)
+
+
+# Parsers for each accepted type, in the order to try them for subclasses.
+_PARSERS = {
+    int: _parse_int,
+    str: _parse_str,
+    Colour: _parse_colour_member,
+    Pixel: _parse_pixel,
+}
+
+
+def _parse_colour(value: Union[int, str, Colour]) -> str:
+    """Parse a colour to a hex string, without caching."""
+    parser = _PARSERS.get(type(value))
+    if not parser:
+        # Fall back to isinstance checks for subclasses (eg. IntEnum).
+        for type_, type_parser in _PARSERS.items():
+            if isinstance(value, type_):
+                parser = type_parser
+                break
+    colour = parser(value) if parser else None
+    if colour is None:
+        raise ValueError(f'Invalid colour "{value}".')
+    return colour
+
+
+# The same few colours tend to be drawn over and over. This must be typed,
+# since a Pixel is equal to (and hashes the same as) a plain tuple, which is
+# not a valid colour.
+_parse_colour_cached = functools.lru_cache(maxsize=512, typed=True)(
+    _parse_colour
+)
+
+
 def parse_colour(value: Union[int, str, Colour]) -> str:
     """Parse a colour to a hex string.
 
-    Accepts integers, strings and instances of the Colour enum.
+    Accepts integers, strings, pixels and instances of the Colour enum.
     """
-    if isinstance(value, int):
-        if value >= 0 and value <= 0xFFFFFF:
-            return f'{value:0>6x}'
-    elif isinstance(value, str):
-        neat_value = value.lstrip('#').upper()
-        if re.match('[0-9A-F]{6}', neat_value):
-            return neat_value
-        if value.upper() in Colour.__members__:
-            return Colour.__members__[value.upper()].value
-    elif isinstance(value, Colour):
-        return value.value
-    elif isinstance(value, Pixel):
-        # Remove leading "#".
-        return str(value)[1:]
-    raise ValueError(f'Invalid colour "{value}".')
+    # Fast path for strings that are already in the format we return.
+    if (
+            type(value) is str and len(value) == 6
+            and _HEX_DIGITS.issuperset(value)):
+        return value
+    try:
+        hash(value)
+    except TypeError:
+        # Can't be cached, but let _parse_colour give the usual error.
+        return _parse_colour(value)
+    return _parse_colour_cached(value)
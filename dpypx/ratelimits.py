@@ -3,94 +3,195 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from dataclasses import dataclass
-from typing import Optional
+import random
+from typing import TYPE_CHECKING, Optional
+
+from multidict import istr
 
-from . import client
 from .errors import MethodNotAllowedError
 
+if TYPE_CHECKING:
+    from .client import Client
+
 
 logger = logging.getLogger('dpypx')
 
+# Header names as istr, so that aiohttp's case-insensitive header dict can
+# skip normalising them on every lookup.
+_COOLDOWN_RESET = istr('Cooldown-Reset')
+_REQUESTS_REMAINING = istr('Requests-Remaining')
+_REQUESTS_LIMIT = istr('Requests-Limit')
+_REQUESTS_RESET = istr('Requests-Reset')
+_REQUESTS_PERIOD = istr('Requests-Period')
+
 
-@dataclass
 class RateLimitEndpoint:
-    """Ratelimiter for a specific endpoint."""
-
-    client: client.Client
-    endpoint: str
-    # We don't care about Requests-Period, we just dynamically wait based on
-    # Requests-Reset.
-    ratelimited: Optional[bool] = None
-    limit: Optional[int] = None
-    remaining: Optional[int] = None
-    reset: Optional[float] = None
-    cooldown_reset: Optional[int] = None
+    """Ratelimiter for a specific endpoint.
+
+    This is a token bucket: tokens refill at a steady rate worked out from
+    the ratelimit headers, and each request takes one. The bucket starts with
+    a single token, so requests are spread out instead of using them all up
+    at once and then waiting for the reset. The server's ratelimit headers
+    only ever lower the number of tokens, never raise it.
+    """
+
+    # These are looked at on every request, and slots make that cheaper.
+    __slots__ = (
+        'client', 'endpoint', 'ratelimited', 'limit', 'remaining', 'reset',
+        'reset_at', 'cooldown_reset', 'tokens', 'rate', 'last_refill',
+        'in_flight', 'lock'
+    )
+
+    def __init__(self, client: Client, endpoint: str):
+        """Set up the ratelimiter, with no information yet."""
+        self.client = client
+        self.endpoint = endpoint
+        self.ratelimited: Optional[bool] = None
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset: Optional[float] = None
+        # Event loop time that the ratelimit resets at. Unlike `reset`, this
+        # doesn't go stale between getting the headers and using them.
+        self.reset_at: Optional[float] = None
+        self.cooldown_reset: Optional[int] = None
+        # Tokens currently in the bucket (may be negative while we wait for a
+        # reset), and how many are added per second.
+        self.tokens: float = 0
+        self.rate: Optional[float] = None
+        self.last_refill: float = 0
+        # Requests that have been sent but not answered yet. The client keeps
+        # this up to date, since the server's headers don't include these.
+        self.in_flight = 0
+        # Only one request waits at a time, so they don't all wake up and
+        # fire at once.
+        self.lock = asyncio.Lock()
 
     def update(self, headers: dict[str, int]):
         """Update the ratelimiter based on the latest headers."""
-        if 'Cooldown-Reset' in headers:
+        get = headers.get
+        cooldown_reset = get(_COOLDOWN_RESET)
+        if cooldown_reset is not None:
             self.remaining = 0
-            self.cooldown_reset = int(headers['Cooldown-Reset'])
+            self.cooldown_reset = int(cooldown_reset)
             return
-        if 'Requests-Remaining' not in headers:
+        remaining = get(_REQUESTS_REMAINING)
+        if remaining is None:
             self.ratelimited = False
             return
+        now = asyncio.get_running_loop().time()
+        started = self.rate is not None
         self.ratelimited = True
-        self.remaining = int(headers['Requests-Remaining'])
-        self.limit = int(headers['Requests-Limit'])
-        self.reset = float(headers['Requests-Reset'])
-
-    async def pause(self):
-        """Pause before sending another request if necessary."""
-        if self.cooldown_reset:
-            logger.error(f'Cooldown: Sleeping for {self.cooldown_reset}s.')
-            await asyncio.sleep(self.cooldown_reset)
-            self.cooldown_reset = None
-            return
-        if self.ratelimited is None:
-            await self.check_limits()
-        if not self.ratelimited:
-            return
-        if self.remaining:
-            logger.debug(
-                f'Not sleeping, {self.remaining} remaining requests.'
-            )
+        self.remaining = int(remaining)
+        self.limit = int(get(_REQUESTS_LIMIT))
+        self.reset = float(get(_REQUESTS_RESET))
+        self.reset_at = now + self.reset
+        period = float(get(_REQUESTS_PERIOD, self.reset))
+        self.rate = self.limit / period if period else None
+        if not self.rate:
+            self.tokens = self.remaining
             return
-        if self.reset:
-            logger.warning(f'Sleeping for {self.reset}s.')
-            await asyncio.sleep(self.reset)
-            self.remaining = self.limit
+        if started:
+            self.refill()
+        else:
+            self.tokens = 1
+            self.last_refill = now
+        # The request this response is for is no longer in flight, but any
+        # others are, and the server hasn't counted them yet.
+        available = self.remaining - max(0, self.in_flight - 1)
+        if available > 0:
+            self.tokens = min(self.tokens, available)
+        else:
+            # Make sure the next token isn't available until the reset.
+            self.tokens = min(self.tokens, 1 - self.reset * self.rate)
+
+    def refill(self):
+        """Add the tokens that have accumulated since the last refill."""
+        now = asyncio.get_running_loop().time()
+        self.tokens = min(
+            self.limit, self.tokens + (now - self.last_refill) * self.rate
+        )
+        self.last_refill = now
+
+    async def sleep(self, delay: float):
+        """Sleep for a delay, plus a little jitter."""
+        await asyncio.sleep(delay + random.uniform(0, 0.05))
+
+    async def pause(self, consume: bool = True):
+        """Pause before sending another request if necessary.
+
+        If `consume` is set, this takes a token for the request about to be
+        sent, otherwise it only waits until one is available.
+        """
+        async with self.lock:
+            if self.cooldown_reset:
+                logger.error(
+                    f'Cooldown: Sleeping for {self.cooldown_reset}s.'
+                )
+                await self.sleep(self.cooldown_reset)
+                self.cooldown_reset = None
+                return
+            if self.ratelimited is None:
+                await self.check_limits()
+            if not self.ratelimited:
+                return
+            if not self.rate:
+                # We can't pace requests, so only wait once there are none
+                # left.
+                if not self.remaining and self.reset_at:
+                    loop = asyncio.get_running_loop()
+                    delay = max(0, self.reset_at - loop.time())
+                    logger.warning(f'Sleeping for {delay:.2f}s.')
+                    await self.sleep(delay)
+                    self.remaining = self.limit
+                return
+            self.refill()
+            if self.tokens >= 1:
+                logger.debug(
+                    f'Not sleeping, {self.tokens:.2f} tokens available.'
+                )
+            # Responses to requests in flight may take tokens away while we
+            # sleep, so check again each time we wake up.
+            while self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+                logger.info(f'Sleeping for {delay:.2f}s.')
+                await self.sleep(delay)
+                self.refill()
+            if consume:
+                self.tokens -= 1
 
     async def check_limits(self):
         """Check the ratelimits with a HEAD request."""
+        self.in_flight += 1
         try:
             # Client.send_request will call self.update.
             await self.client.send_request('HEAD', self.endpoint)
         except MethodNotAllowedError:
             self.ratelimited = False
+        finally:
+            self.in_flight -= 1
 
 
 class RateLimiter:
     """Ratelimiters for all the endpoints."""
 
-    def __init__(self, client: client.Client):
+    def __init__(self, client: Client):
         """Set up the ratelimiter."""
         self.client = client
-        self.ratelimits = {}
+        self.ratelimits: dict[str, RateLimitEndpoint] = {}
 
     def __getitem__(self, endpoint: str) -> RateLimitEndpoint:
-        """Get the ratelimiter for a specific endpoint."""
-        if endpoint not in self.ratelimits:
-            self.ratelimits[endpoint] = RateLimitEndpoint(
+        """Get (or create) the ratelimiter for a specific endpoint."""
+        ratelimit = self.ratelimits.get(endpoint)
+        if ratelimit is None:
+            ratelimit = self.ratelimits[endpoint] = RateLimitEndpoint(
                 self.client, endpoint
             )
-        return self.ratelimits[endpoint]
+        return ratelimit
 
     def update(self, endpoint: str, headers: dict[str, int]):
         """Update the ratelimits for an endpoint with the latest headers."""
         self[endpoint].update(headers)
 
-    async def pause(self, endpoint: str):
+    async def pause(self, endpoint: str, consume: bool = True):
         """Pause before sending another request for an endpoint."""
-        await self[endpoint].pause()
+        await self[endpoint].pause(consume)